@@ -1,26 +1,54 @@
 import time
+import select
+import signal
+import threading
 import logging
+import orjson
 import requests
+import psycopg2
+import psycopg2.extensions
 import sys
 import os
 import io
 from datetime import datetime, timezone
 
-# ensure utf-8 stdout (for PVPRunAll GUI)
-sys.stdout = io.TextIOWrapper(sys.stdout.buffer, encoding="utf-8")
+# ensure utf-8 stdout (for PVPRunAll GUI); line-buffered so log writes
+# coalesce into one syscall per line instead of double-buffering
+sys.stdout = io.TextIOWrapper(sys.stdout.buffer, encoding="utf-8",
+                              line_buffering=True, write_through=True)
 sys.path.append(os.path.abspath(os.path.join(os.path.dirname(__file__), "..")))
 
 from common.db import get_db_connection
-import urllib3
+from http_retry import post_with_retry, SSLContextAdapter, make_ssl_context
 
 # configuration
 API_URL = "https://pvp-local-api-test/api/handling-units/save"
 REQUEST_TIMEOUT = 12
 MAX_HTTP_ATTEMPTS = 4
 INITIAL_BACKOFF_SEC = 1.0
+NOTIFY_CHANNEL = "pvpedge_new_order"  # see sql/0001_notify_triggers.sql
+NOTIFY_WAIT_SEC = 30
 
-# disable insecure warnings (we still use verify=False below as original)
-urllib3.disable_warnings(urllib3.exceptions.InsecureRequestWarning)
+# one session for the whole service lifetime: keep-alive reuses the TCP+TLS
+# connection instead of paying a fresh handshake on every POST, with one
+# verified SSLContext (local CA bundle) shared across the pool
+SESSION = requests.Session()
+SESSION.headers.update({
+    "Accept": "application/json",
+    "Content-Type": "application/json"
+})
+SESSION.mount("https://", SSLContextAdapter(
+    ssl_context=make_ssl_context(),
+    pool_connections=2, pool_maxsize=8, max_retries=0))
+
+# constant payload fields, built once; send_one_order merges in the three
+# per-order values
+PAYLOAD_BASE = {
+    "plantCode": "PL02",
+    "wrapped": True,
+    "wrapperEnabled": True,
+    "readerEnabled": True
+}
 
 # logger
 logging.basicConfig(
@@ -31,53 +59,63 @@ logging.basicConfig(
 )
 log = logging.getLogger("api_service")
 
+# graceful shutdown: SIGTERM sets the event and writes the wake pipe so the
+# select() in wait_for_notify returns immediately instead of after timeout
+STOP = threading.Event()
+_STOP_RFD, _STOP_WFD = os.pipe()
+
+def _handle_stop_signal(signum, frame):
+    STOP.set()
+    os.write(_STOP_WFD, b"x")
+
+# 1s-granularity cache for the "now" string: the format drops milliseconds
+# anyway, so within the same second the previous result is reused
+_LAST_SEC = [0, ""]
+
+def _zulu_now():
+    s = int(time.time())
+    c = _LAST_SEC
+    if s != c[0]:
+        c[0] = s
+        c[1] = time.strftime("%Y-%m-%dT%H:%M:%SZ", time.gmtime(s))
+    return c[1]
+
 def to_zulu_str(ts):
     """Convert a datetime (naive or aware) to 'YYYY-MM-DDTHH:MM:SSZ' (UTC, no ms).
        If ts is None, return current UTC time string."""
     if ts is None:
-        return datetime.now(timezone.utc).strftime("%Y-%m-%dT%H:%M:%SZ")
+        return _zulu_now()
     if not isinstance(ts, datetime):
         # safety: if ts not datetime, fallback to now
-        return datetime.now(timezone.utc).strftime("%Y-%m-%dT%H:%M:%SZ")
+        return _zulu_now()
     if ts.tzinfo is None:
         ts = ts.replace(tzinfo=timezone.utc)
     ts_utc = ts.astimezone(timezone.utc)
     return ts_utc.strftime("%Y-%m-%dT%H:%M:%SZ")
 
-def post_with_retry(session, url, json_payload, max_attempts=MAX_HTTP_ATTEMPTS, initial_backoff=INITIAL_BACKOFF_SEC):
-    """POST with simple exponential backoff. Returns (response, response_text) or raises last exception."""
-    attempt = 1
-    while True:
-        try:
-            log.info(f"HTTP POST attempt {attempt}/{max_attempts} (payload id={json_payload.get('pvpEdgeId')})")
-            resp = session.post(url, json=json_payload, timeout=REQUEST_TIMEOUT, verify=False)
-            # Always return response; caller decides if it's success. We'll retry on server errors (5xx) or 429.
-            status = resp.status_code
-            text_snippet = (resp.text[:500] + '...') if len(resp.text) > 500 else resp.text
-            log.info(f"HTTP response status={status}; body_snippet={text_snippet!r}")
-            if status >= 500 or status == 429:
-                if attempt < max_attempts:
-                    backoff = initial_backoff * (2 ** (attempt - 1))
-                    log.warning(f"Server error or rate limit (status={status}), retrying after {backoff}s")
-                    time.sleep(backoff)
-                    attempt += 1
-                    continue
-            return resp
-        except requests.RequestException as e:
-            log.error(f"RequestException on attempt {attempt}: {e}")
-            if attempt < max_attempts:
-                backoff = initial_backoff * (2 ** (attempt - 1))
-                log.info(f"Retrying HTTP in {backoff}s")
-                time.sleep(backoff)
-                attempt += 1
-                continue
-            # re-raise the last exception to caller
-            raise
+def open_listen_connection():
+    """Dedicated autocommit connection LISTENing for new-order notifications."""
+    conn = get_db_connection()
+    conn.set_isolation_level(psycopg2.extensions.ISOLATION_LEVEL_AUTOCOMMIT)
+    with conn.cursor() as cur:
+        cur.execute(f"LISTEN {NOTIFY_CHANNEL};")
+    return conn
 
-def fetch_next_order(conn):
-    """Return single next order row or None: (id, hu, confirm, timestamp)"""
+def wait_for_notify(listen_conn, timeout=NOTIFY_WAIT_SEC):
+    """Block until a notification arrives, shutdown is requested, or the
+       safety timeout expires."""
+    select.select([listen_conn, _STOP_RFD], [], [], timeout)
+    if STOP.is_set():
+        return
+    listen_conn.poll()
+    listen_conn.notifies.clear()
+
+def prepare_statements(conn):
+    """Server-side PREPARE for the hot statements, so Postgres parses and
+       plans them once per connection instead of on every execute."""
     with conn.cursor() as cur:
         cur.execute("""
+            PREPARE stmt_fetch_next AS
             SELECT pvpedge_orders_id,
                    pvpedge_orders_hu,
                    pvpedge_orders_confirm,
@@ -87,57 +125,63 @@ def fetch_next_order(conn):
               AND pvpedge_orders_confirm IS NOT NULL
             ORDER BY pvpedge_orders_timestamp ASC
             LIMIT 1
+            FOR UPDATE SKIP LOCKED;
         """)
+        cur.execute("""
+            PREPARE stmt_mark_sent AS
+            UPDATE pvpedge_orders
+            SET api_data_sent = TRUE
+            WHERE pvpedge_orders_id = $1;
+        """)
+    conn.commit()
+
+def fetch_next_order(conn):
+    """Return single next order row or None: (id, hu, confirm, timestamp)"""
+    with conn.cursor() as cur:
+        cur.execute("EXECUTE stmt_fetch_next")
         return cur.fetchone()
 
 def mark_order_sent(conn, order_id):
     with conn.cursor() as cur:
-        cur.execute("""
-            UPDATE pvpedge_orders
-            SET api_data_sent = TRUE
-            WHERE pvpedge_orders_id = %s
-        """, (order_id,))
+        cur.execute("EXECUTE stmt_mark_sent (%s)", (order_id,))
     conn.commit()
 
-def send_one_order():
-    conn = None
+def send_one_order(conn):
+    """Send the next pending order. Returns True when an order was sent and
+       marked, so the caller knows to drain the queue before blocking."""
     try:
-        conn = get_db_connection()
-        if not conn:
-            log.error("No DB connection available")
-            return
-
+        # the SELECT takes a row lock (FOR UPDATE SKIP LOCKED) that is held
+        # until mark_order_sent commits, so parallel workers never pick the
+        # same order; every early exit must rollback to release it
         row = fetch_next_order(conn)
         if not row:
             # nothing to do
-            return
+            conn.rollback()
+            return False
 
         order_id, hu, confirm, ts = row
         scan_timestamp = to_zulu_str(ts)
         payload = {
+            **PAYLOAD_BASE,
             "pvpEdgeId": int(order_id),
-            "plantCode": "PL02",
             "handlingUnitLabelCode": hu,
-            "wrapped": True,
-            "wrapperEnabled": True,
-            "labelConfirmed": True if int(confirm) == 1 else False,
-            "readerEnabled": True,
+            "labelConfirmed": int(confirm) == 1,
             "scanTimestamp": scan_timestamp
         }
 
         log.info(f"Preparing to send order id={order_id}, hu={hu}, confirm={confirm}, scanTimestamp={scan_timestamp}")
-        session = requests.Session()
-        # set sensible headers
-        session.headers.update({
-            "Accept": "application/json",
-            "Content-Type": "application/json"
-        })
-
         try:
-            resp = post_with_retry(session, API_URL, payload)
+            # orjson.dumps + data= skips both stdlib json and the dict copy
+            # requests makes for json=; Content-Type is set on the session
+            resp = post_with_retry(SESSION, API_URL, log=log,
+                                   max_attempts=MAX_HTTP_ATTEMPTS,
+                                   initial_backoff=INITIAL_BACKOFF_SEC,
+                                   data=orjson.dumps(payload),
+                                   timeout=REQUEST_TIMEOUT)
         except Exception as e:
             log.error(f"HTTP POST failed after retries for id={order_id}: {e}")
-            return
+            conn.rollback()
+            return False
 
         # parse response JSON safely
         resp_json = {}
@@ -155,6 +199,7 @@ def send_one_order():
             try:
                 mark_order_sent(conn, order_id)
                 log.info(f"Marked order id={order_id} as api_data_sent = TRUE")
+                return True
             except Exception as e:
                 log.error(f"Database update after API success failed for id={order_id}: {e}")
                 try:
@@ -165,25 +210,61 @@ def send_one_order():
             # not successful: log details for later manual inspection
             snippet = (resp.text[:1000] + "...") if resp.text and len(resp.text) > 1000 else resp.text
             log.warning(f"API returned non-success for id={order_id}: http={resp.status_code}, ok={ok_flag}, body_snippet={snippet}")
+        try:
+            conn.rollback()
+        except Exception:
+            pass
+        return False
 
+    except (psycopg2.OperationalError, psycopg2.InterfaceError):
+        # let main() reconnect
+        raise
     except Exception as e:
         log.exception(f"Unexpected error in send_one_order: {e}")
-    finally:
-        if conn:
-            try:
-                conn.close()
-            except Exception:
-                pass
+        return False
 
 def main():
     log.info("api_service started")
-    while True:
+    signal.signal(signal.SIGTERM, _handle_stop_signal)
+    signal.signal(signal.SIGINT, _handle_stop_signal)
+    conn = None
+    listen_conn = None
+    while not STOP.is_set():
         try:
-            send_one_order()
+            # one connection for the service lifetime; reconnect only on error
+            if conn is None or conn.closed:
+                conn = get_db_connection()
+                prepare_statements(conn)
+            if listen_conn is None or listen_conn.closed:
+                listen_conn = open_listen_connection()
+            if send_one_order(conn):
+                # an order went out; drain the queue before blocking again
+                continue
+            # idle (or the last attempt failed): block until a NOTIFY arrives;
+            # the timeout doubles as the retry interval for failed orders
+            wait_for_notify(listen_conn)
+        except (psycopg2.OperationalError, psycopg2.InterfaceError) as e:
+            log.error(f"DB connection error: {e}; reconnecting")
+            for c in (conn, listen_conn):
+                if c:
+                    try:
+                        c.close()
+                    except Exception:
+                        pass
+            conn = None
+            listen_conn = None
+            STOP.wait(timeout=1)
         except Exception as e:
             log.exception(f"Top-level loop error: {e}")
-        # small sleep to avoid busy-looping
-        time.sleep(1)
+            STOP.wait(timeout=1)
+
+    log.info("api_service stopping")
+    for c in (conn, listen_conn):
+        if c:
+            try:
+                c.close()
+            except Exception:
+                pass
 
 if __name__ == "__main__":
     main()
@@ -0,0 +1,81 @@
+import ssl
+import time
+import logging
+import requests
+
+# defaults match the original api_service retry policy
+MAX_HTTP_ATTEMPTS = 4
+INITIAL_BACKOFF_SEC = 1.0
+
+# CA bundle for the pvp-local-api endpoints
+CA_BUNDLE = "/etc/pvp/ca.pem"
+
+
+class SSLContextAdapter(requests.adapters.HTTPAdapter):
+    """HTTPAdapter sharing one SSLContext for the process lifetime.
+
+    Ciphers and the CA bundle are loaded once instead of per adapter
+    pool, and a stable context lets TLS session resumption work across
+    keep-alive refreshes."""
+
+    def __init__(self, ssl_context=None, **kwargs):
+        self._ssl_context = ssl_context
+        super().__init__(**kwargs)
+
+    def init_poolmanager(self, *args, **kwargs):
+        if self._ssl_context is not None:
+            kwargs["ssl_context"] = self._ssl_context
+        return super().init_poolmanager(*args, **kwargs)
+
+
+def make_ssl_context(cafile=CA_BUNDLE):
+    ctx = ssl.create_default_context(cafile=cafile)
+    ctx.check_hostname = True
+    return ctx
+
+
+def post_with_retry(session, url, log=None, max_attempts=MAX_HTTP_ATTEMPTS,
+                    initial_backoff=INITIAL_BACKOFF_SEC, body_factory=None,
+                    **post_kwargs):
+    """POST with exponential backoff on 5xx/429 or RequestException.
+
+    Extra keyword arguments are passed straight to session.post
+    (json=, data=, headers=, timeout=...). Streaming bodies are consumed
+    by a failed attempt, so callers sending one pass body_factory — a
+    callable returning fresh kwargs (e.g. a new MultipartEncoder) that
+    are merged in per attempt. Returns the last Response or re-raises
+    the last RequestException."""
+    log = log or logging.getLogger(__name__)
+    attempt = 1
+    while True:
+        try:
+            log.info("HTTP POST attempt %d/%d → %s", attempt, max_attempts, url)
+            kwargs = post_kwargs
+            if body_factory is not None:
+                kwargs = dict(post_kwargs)
+                kwargs.update(body_factory())
+            resp = session.post(url, **kwargs)
+            status = resp.status_code
+            log.info("HTTP response status=%s", status)
+            if log.isEnabledFor(logging.DEBUG):
+                # resp.text forces decoding of the whole body; only pay for
+                # it when the snippet will actually be emitted
+                log.debug("body_snippet=%r", resp.text[:500])
+            if status >= 500 or status == 429:
+                if attempt < max_attempts:
+                    backoff = initial_backoff * (2 ** (attempt - 1))
+                    log.warning("Server error or rate limit (status=%s), retrying after %ss", status, backoff)
+                    time.sleep(backoff)
+                    attempt += 1
+                    continue
+            return resp
+        except requests.RequestException as e:
+            log.error("RequestException on attempt %d: %s", attempt, e)
+            if attempt < max_attempts:
+                backoff = initial_backoff * (2 ** (attempt - 1))
+                log.info("Retrying HTTP in %ss", backoff)
+                time.sleep(backoff)
+                attempt += 1
+                continue
+            # re-raise the last exception to caller
+            raise
@@ -2,18 +2,47 @@ import os
 import sys
 import io
 import time
+import select
 import logging
 import requests
-import urllib3
 import psycopg2
- 
-sys.stdout = io.TextIOWrapper(sys.stdout.buffer, encoding="cp1250", errors="replace")
+import psycopg2.extensions
+from concurrent.futures import ThreadPoolExecutor
+from requests_toolbelt.multipart.encoder import MultipartEncoder
+
+# line-buffered so log writes coalesce into one syscall per line
+sys.stdout = io.TextIOWrapper(sys.stdout.buffer, encoding="cp1250", errors="replace",
+                              line_buffering=True, write_through=True)
 sys.path.append(os.path.abspath(os.path.join(os.path.dirname(__file__), "..")))
 
 from common.db import get_db_connection
+from http_retry import post_with_retry, SSLContextAdapter, make_ssl_context
 
 PHOTO_API_URL = "https://pvp-local-api-test/api/photos/upload"
-urllib3.disable_warnings(urllib3.exceptions.InsecureRequestWarning)
+NOTIFY_CHANNEL = "pvpedge_new_image"  # see sql/0001_notify_triggers.sql
+NOTIFY_WAIT_SEC = 30
+
+# blob column, API photo type and bit in image_sent_mask (sql/0004)
+PHOTO_COLUMNS = [
+    ("pvpedge_orders_image_ftp",          "READER",        1),
+    ("pvpedge_orders_image_cam1",         "CAM_1",         2),
+    ("pvpedge_orders_image_cam2",         "CAM_2",         4),
+    ("pvpedge_orders_image_cam1_wrapped", "WRAPPED_CAM_1", 8),
+    ("pvpedge_orders_image_cam2_wrapped", "WRAPPED_CAM_2", 16),
+]
+ALL_PHOTOS_MASK = 31
+
+# one session for the whole service lifetime: keep-alive reuses the TCP+TLS
+# connection across photo uploads instead of re-handshaking each time, with
+# one verified SSLContext (local CA bundle) shared across the pool
+SESSION = requests.Session()
+SESSION.mount("https://", SSLContextAdapter(
+    ssl_context=make_ssl_context(),
+    pool_connections=2, pool_maxsize=8, max_retries=0))
+
+# the five per-order uploads are independent I/O, so run them in parallel;
+# pool size matches the per-order fanout (pool_maxsize above covers the sockets)
+EXECUTOR = ThreadPoolExecutor(max_workers=5)
 
 logging.basicConfig(
     level=logging.INFO,
@@ -33,19 +62,24 @@ def send_image(order_id: int, blob: bytes | None, photo_type: str) -> bool:
 
     file_name = f"{photo_type.lower()}.jpg"
     try:
-        logging.info(f"[SEND] Sending '{file_name}' (type={photo_type}) "
-                     f"for id={order_id} → {PHOTO_API_URL}")
-
-        files = {
-            "photo": (file_name, blob, "image/jpeg")
-        }
-        data = {
-            "pvpEdgeHandlingUnitId": str(order_id),
-            "photoType": photo_type
-        }
-
-        resp = requests.post(PHOTO_API_URL, files=files, data=data,
-                             timeout=15, verify=False)
+        # %-style args so the line is only formatted when DEBUG is enabled
+        logging.debug("[SEND] Sending '%s' (type=%s) for id=%s → %s",
+                      file_name, photo_type, order_id, PHOTO_API_URL)
+
+        # stream the body in chunks instead of letting requests build a
+        # second in-memory copy of the whole multipart payload; a failed
+        # attempt consumes the encoder, so build a fresh one per retry
+        def encoder_kwargs():
+            encoder = MultipartEncoder(fields={
+                "pvpEdgeHandlingUnitId": str(order_id),
+                "photoType": photo_type,
+                "photo": (file_name, io.BytesIO(blob), "image/jpeg")
+            })
+            return {"data": encoder,
+                    "headers": {"Content-Type": encoder.content_type}}
+
+        resp = post_with_retry(SESSION, PHOTO_API_URL,
+                               body_factory=encoder_kwargs, timeout=15)
 
         ok = False
         try:
@@ -55,8 +89,9 @@ def send_image(order_id: int, blob: bytes | None, photo_type: str) -> bool:
             j = {}
 
         if resp.status_code == 200 and ok:
-            logging.info(f"[OK] '{file_name}' (type={photo_type}) "
-                         f"for id={order_id} sent successfully")
+            # per-photo success is hot-path noise; [DONE] logs the aggregate
+            logging.debug("[OK] '%s' (type=%s) for id=%s sent successfully",
+                          file_name, photo_type, order_id)
             return True
         else:
             logging.warning(
@@ -72,45 +107,87 @@ def send_image(order_id: int, blob: bytes | None, photo_type: str) -> bool:
         return False
 
 
+def open_listen_connection():
+    """
+    Opens a dedicated autocommit connection that LISTENs for
+    new-image notifications (see sql/0001_notify_triggers.sql).
+    """
+    conn = get_db_connection()
+    conn.set_isolation_level(psycopg2.extensions.ISOLATION_LEVEL_AUTOCOMMIT)
+    with conn.cursor() as cur:
+        cur.execute(f"LISTEN {NOTIFY_CHANNEL};")
+    return conn
+
+
+def wait_for_notify(listen_conn, timeout=NOTIFY_WAIT_SEC):
+    """
+    Blocks until a notification arrives on the LISTEN connection
+    or the timeout expires (safety net against missed NOTIFYs).
+    """
+    select.select([listen_conn], [], [], timeout)
+    listen_conn.poll()
+    listen_conn.notifies.clear()
+
+
 def process_unsent_images():
     logging.info("photo_api_service started")
+    listen_conn = None
     while True:
         conn = None
         try:
+            if listen_conn is None or listen_conn.closed:
+                listen_conn = open_listen_connection()
+
             conn = get_db_connection()
             with conn.cursor() as cur:
+                # fetch only id + mask here; blobs are pulled one at a time
+                # below so already-sent photos never leave the database
                 cur.execute("""
-                    SELECT
-                        pvpedge_orders_id,
-                        pvpedge_orders_image_ftp,
-                        pvpedge_orders_image_cam1,
-                        pvpedge_orders_image_cam2,
-                        pvpedge_orders_image_cam1_wrapped,
-                        pvpedge_orders_image_cam2_wrapped
+                    SELECT pvpedge_orders_id, image_sent_mask
                     FROM pvpedge_orders
                     WHERE pvpedge_orders_images_blob_saved = TRUE
-                      AND pvpedge_orders_images_sent = FALSE
+                      AND image_sent_mask <> %s
                     ORDER BY pvpedge_orders_id ASC
                     LIMIT 1
-                """)
+                    FOR UPDATE SKIP LOCKED
+                """, (ALL_PHOTOS_MASK,))
                 row = cur.fetchone()
 
             if not row:
-                time.sleep(5)
+                conn.rollback()
+                wait_for_notify(listen_conn)
                 continue
 
-            (order_id, img_reader, img_cam1, img_cam2,
-             img_wrapped1, img_wrapped2) = row
-
-            logging.info(f"[PROCESS] New image package for id={order_id}")
+            order_id, sent_mask = row
+            logging.info(f"[PROCESS] Image package for id={order_id} "
+                         f"(mask={sent_mask})")
 
-            ok_reader   = send_image(order_id, img_reader,   "READER")
-            ok_cam1     = send_image(order_id, img_cam1,     "CAM_1")
-            ok_cam2     = send_image(order_id, img_cam2,     "CAM_2")
-            ok_wrap1    = send_image(order_id, img_wrapped1, "WRAPPED_CAM_1")
-            ok_wrap2    = send_image(order_id, img_wrapped2, "WRAPPED_CAM_2")
-
-            if ok_reader and ok_cam1 and ok_cam2 and ok_wrap1 and ok_wrap2:
+            pending = []
+            for column, photo_type, bit in PHOTO_COLUMNS:
+                if sent_mask & bit:
+                    continue
+                with conn.cursor() as cur:
+                    cur.execute(f"""
+                        SELECT {column}
+                        FROM pvpedge_orders
+                        WHERE pvpedge_orders_id = %s
+                    """, (order_id,))
+                    blob = cur.fetchone()[0]
+                pending.append(
+                    (bit, EXECUTOR.submit(send_image, order_id, blob, photo_type)))
+
+            for bit, future in pending:
+                if future.result():
+                    with conn.cursor() as cur:
+                        cur.execute("""
+                            UPDATE pvpedge_orders
+                            SET image_sent_mask = image_sent_mask | %s
+                            WHERE pvpedge_orders_id = %s
+                        """, (bit, order_id))
+                    conn.commit()
+                    sent_mask |= bit
+
+            if sent_mask == ALL_PHOTOS_MASK:
                 with conn.cursor() as cur:
                     cur.execute("""
                         UPDATE pvpedge_orders
@@ -124,6 +201,12 @@ def process_unsent_images():
 
         except (psycopg2.InterfaceError, psycopg2.OperationalError) as db_err:
             logging.error(f"[DB] Database connection error: {db_err}")
+            if listen_conn:
+                try:
+                    listen_conn.close()
+                except Exception:
+                    pass
+                listen_conn = None
             time.sleep(10)
         except Exception as e:
             logging.error(f"[LOOP] Main loop error: {e}")
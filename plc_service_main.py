@@ -2,13 +2,15 @@ import time
 import logging
 import sys
 import traceback
-from datetime import datetime, timezone
+import psycopg2
 import io
 import os
 
 from pylogix import PLC
 
-sys.stdout = io.TextIOWrapper(sys.stdout.buffer, encoding="utf-8")
+# line-buffered so log writes coalesce into one syscall per line
+sys.stdout = io.TextIOWrapper(sys.stdout.buffer, encoding="utf-8",
+                              line_buffering=True, write_through=True)
 sys.path.append(os.path.abspath(os.path.join(os.path.dirname(__file__), "..")))
 
 from common.db import get_db_connection
@@ -19,6 +21,15 @@ TRIGGER_TAG = "PaletPosition"
 LABEL_OK_TAG = "LabelOk"
 LABEL_NOK_TAG = "LabelNotOk"
 
+# adaptive poll: 50 ms right after an edge (to catch the falling edge fast),
+# backing off to 500 ms while the trigger is idle
+POLL_MIN_SLEEP = 0.05
+POLL_MAX_SLEEP = 0.5
+
+# last seen trigger value, persisted so a restart does not re-fire the
+# rising-edge path for an order that was already acknowledged
+STATE_FILE = "plc_trigger.state"
+
 logging.basicConfig(
     stream=sys.stdout,
     level=logging.INFO,
@@ -27,54 +38,103 @@ logging.basicConfig(
 
 
 # --- HELPERS ---
-def zulu_timestamp():
-    """Return current UTC time in Zulu format without milliseconds."""
-    return datetime.now(timezone.utc).strftime("%Y-%m-%dT%H:%M:%SZ")
+# 1s-granularity cache: the format drops milliseconds, so within the same
+# second the previously formatted string is reused
+_LAST_SEC = [0, ""]
 
 
-# --- DATABASE FUNCTIONS ---
-def get_latest_unconfirmed_order():
-    """Fetch the latest order that has not been acknowledged by PLC."""
+def load_previous_trigger():
+    """Restore the persisted trigger state (None when no state file exists)."""
     try:
-        with get_db_connection() as conn:
-            with conn.cursor() as cur:
-                cur.execute("""
-                    SELECT pvpedge_orders_id, pvpedge_orders_confirm
-                    FROM pvpedge_orders
-                    WHERE plc_ack_sent = FALSE
-                    ORDER BY pvpedge_orders_id DESC
-                    LIMIT 1
-                """)
-                return cur.fetchone()
-    except Exception as e:
-        logging.error(f"[DB ERROR] Failed to fetch latest unconfirmed order: {e}")
+        with open(STATE_FILE, "r", encoding="ascii") as f:
+            return int(f.read().strip())
+    except (OSError, ValueError):
         return None
 
 
-def mark_order_acknowledged(order_id):
-    """Mark order as acknowledged and set timestamp."""
+def save_previous_trigger(value):
+    """Atomically persist the trigger state via a temp file + os.replace."""
+    tmp = STATE_FILE + ".tmp"
     try:
-        with get_db_connection() as conn:
-            with conn.cursor() as cur:
-                cur.execute("""
-                    UPDATE pvpedge_orders
-                    SET plc_ack_sent = TRUE,
-                        pvpedge_ack_plc_timestamp = %s
-                    WHERE pvpedge_orders_id = %s
-                """, (zulu_timestamp(), order_id))
-                conn.commit()
-                logging.info(f"[DB] Order ID={order_id} acknowledged with PLC timestamp")
+        with open(tmp, "w", encoding="ascii") as f:
+            f.write(str(int(value)))
+        os.replace(tmp, STATE_FILE)
+    except (OSError, TypeError, ValueError) as e:
+        logging.warning(f"[STATE] Failed to persist trigger state: {e}")
+
+
+def zulu_timestamp():
+    """Return current UTC time in Zulu format without milliseconds."""
+    s = int(time.time())
+    c = _LAST_SEC
+    if s != c[0]:
+        c[0] = s
+        c[1] = time.strftime("%Y-%m-%dT%H:%M:%SZ", time.gmtime(s))
+    return c[1]
+
+
+# --- DATABASE FUNCTIONS ---
+def prepare_statements(conn):
+    """Server-side PREPARE so the per-edge statement is planned once
+       per connection."""
+    with conn.cursor() as cur:
+        cur.execute("""
+            PREPARE stmt_ack_latest AS
+            UPDATE pvpedge_orders
+            SET plc_ack_sent = TRUE,
+                pvpedge_ack_plc_timestamp = now() AT TIME ZONE 'UTC'
+            WHERE pvpedge_orders_id = (
+                SELECT pvpedge_orders_id
+                FROM pvpedge_orders
+                WHERE plc_ack_sent = FALSE
+                ORDER BY pvpedge_orders_id DESC
+                LIMIT 1
+                FOR UPDATE SKIP LOCKED
+            )
+            RETURNING pvpedge_orders_id, pvpedge_orders_confirm;
+        """)
+    conn.commit()
+
+
+def acknowledge_latest_order(conn):
+    """Atomically lock, acknowledge and return the latest unacked order
+       in a single round-trip; the timestamp is set server-side.
+       Returns (order_id, confirm) or None."""
+    try:
+        with conn.cursor() as cur:
+            cur.execute("EXECUTE stmt_ack_latest")
+            row = cur.fetchone()
+        if row:
+            conn.commit()
+            logging.info(f"[DB] Order ID={row[0]} acknowledged with PLC timestamp")
+        else:
+            conn.rollback()
+        return row
+    except (psycopg2.OperationalError, psycopg2.InterfaceError):
+        raise
     except Exception as e:
-        logging.error(f"[DB ERROR] Failed to update order ID={order_id}: {e}")
+        logging.error(f"[DB ERROR] Failed to acknowledge latest order: {e}")
+        try:
+            conn.rollback()
+        except Exception:
+            pass
+        return None
 
 
 # --- MAIN SERVICE ---
 def run_plc_service():
     logging.info(f"[START] plc_service started at {zulu_timestamp()}")
 
+    # one connection for the service lifetime; reconnect only on error
+    conn = get_db_connection()
+    prepare_statements(conn)
+
     with PLC() as comm:
         comm.IPAddress = PLC_IP
-        previous_trigger = None
+        previous_trigger = load_previous_trigger()
+        if previous_trigger is not None:
+            logging.info(f"[STATE] Restored previous_trigger={previous_trigger}")
+        idle_ticks = 0
 
         while True:
             try:
@@ -90,14 +150,13 @@ def run_plc_service():
                 if trigger == 1 and previous_trigger != 1:
                     logging.info("[PLC] Rising edge detected")
 
-                    # Reset tags
-                    comm.Write(LABEL_OK_TAG, 0)
-                    comm.Write(LABEL_NOK_TAG, 0)
+                    # Reset tags in one Multiple Service Packet request
+                    comm.Write([(LABEL_OK_TAG, 0), (LABEL_NOK_TAG, 0)])
 
-                    order = get_latest_unconfirmed_order()
+                    order = acknowledge_latest_order(conn)
                     if order:
                         order_id, confirm = order
-                        logging.info(f"[PLC] Fetched from DB: ID={order_id}, CONFIRM={confirm}")
+                        logging.info(f"[PLC] Acknowledged in DB: ID={order_id}, CONFIRM={confirm}")
 
                         if confirm == 1:
                             comm.Write(LABEL_OK_TAG, 1)
@@ -107,20 +166,33 @@ def run_plc_service():
                             logging.info(f"[PLC] Sent {LABEL_NOK_TAG} = 1")
                         else:
                             logging.warning(f"[PLC] Unknown CONFIRM value for ID={order_id}")
-
-                        mark_order_acknowledged(order_id)
                     else:
                         logging.info("[PLC] No unconfirmed orders found")
 
                 # Falling edge (1 → 0)
                 elif trigger == 0 and previous_trigger == 1:
-                    comm.Write(LABEL_OK_TAG, 0)
-                    comm.Write(LABEL_NOK_TAG, 0)
+                    comm.Write([(LABEL_OK_TAG, 0), (LABEL_NOK_TAG, 0)])
                     logging.info("[PLC] Falling edge detected — reset OK/NOK tags")
 
-                previous_trigger = trigger
-                time.sleep(0.2)
+                if trigger != previous_trigger:
+                    idle_ticks = 0
+                    save_previous_trigger(trigger)
+                else:
+                    idle_ticks += 1
 
+                previous_trigger = trigger
+                time.sleep(min(POLL_MAX_SLEEP,
+                               POLL_MIN_SLEEP + POLL_MIN_SLEEP * idle_ticks))
+
+            except (psycopg2.OperationalError, psycopg2.InterfaceError) as e:
+                logging.error(f"[DB ERROR] Connection lost: {e} — reconnecting")
+                try:
+                    conn.close()
+                except Exception:
+                    pass
+                time.sleep(2)
+                conn = get_db_connection()
+                prepare_statements(conn)
             except Exception as e:
                 logging.error(f"[EXCEPTION] Error in PLC loop: {e}")
                 traceback.print_exc()
@@ -1,9 +1,12 @@
 import requests
 import psycopg2
+import psycopg2.extras
 import time
 import logging
 from psycopg2 import OperationalError, DatabaseError
 
+from http_retry import SSLContextAdapter, make_ssl_context
+
 DB_CONFIG = {
     'host': 'localhost',
     'port': 5432,
@@ -15,6 +18,14 @@ DB_CONFIG = {
 API_BASE_URL = "https://pvp-local-api-test/api/sap-orders/getIdGreaterThan/"
 POLL_INTERVAL = 5
 
+# one session for the whole service lifetime: keep-alive reuses the TCP+TLS
+# connection across polls instead of re-handshaking every POLL_INTERVAL,
+# with one verified SSLContext (local CA bundle) shared across the pool
+SESSION = requests.Session()
+SESSION.mount("https://", SSLContextAdapter(
+    ssl_context=make_ssl_context(),
+    pool_connections=2, pool_maxsize=8, max_retries=0))
+
 logging.basicConfig(
     level=logging.INFO,
     format="%(asctime)s [%(levelname)s] %(message)s",
@@ -37,9 +48,16 @@ def connect_db():
 def get_last_id(conn):
     try:
         with conn.cursor() as cur:
-            cur.execute("SELECT COALESCE(MAX(pvpedge_sapapi_lastid), 0) FROM pvpedge_sapapi;")
-            last_id = cur.fetchone()[0]
-            return last_id
+            # indexed single-row lookup (see sql/0002_sapapi_lastid_index.sql)
+            # instead of a seq-scanning MAX()
+            cur.execute("""
+                SELECT pvpedge_sapapi_lastid
+                FROM pvpedge_sapapi
+                ORDER BY pvpedge_sapapi_lastid DESC
+                LIMIT 1;
+            """)
+            row = cur.fetchone()
+            return row[0] if row else 0
     except DatabaseError as e:
         logging.error(f"Error fetching lastId: {e}")
         return 0
@@ -47,7 +65,7 @@ def get_last_id(conn):
 def fetch_new_orders_from_api(last_id):
     url = f"{API_BASE_URL}{last_id}"
     try:
-        response = requests.get(url, verify=False, timeout=10)
+        response = SESSION.get(url, timeout=10)
         response.raise_for_status()
         data = response.json()
         return data
@@ -55,10 +73,33 @@ def fetch_new_orders_from_api(last_id):
         logging.error(f"API request error: {e}")
         return None
 
-def insert_order_to_db(conn, record, new_id):
+def insert_orders_to_db(conn, records, start_id):
+    """Batch-insert all records in one round-trip and one commit.
+       Returns the number of rows handed to the database."""
+    rows = []
+    new_id = start_id
+    for record in records:
+        rows.append((
+            new_id,
+            record.get("lineNo"),
+            record.get("index"),
+            record.get("packaging"),
+            None,  # content not provided
+            record.get("batch"),
+            record.get("count"),
+            record.get("order"),
+            record.get("ean"),
+            record.get("prodDate"),
+            None,  # tStamp not provided
+            None,  # confirm not provided
+            record.get("palletNumber"),
+            record.get("handlingUnitLabelCode")
+        ))
+        new_id += 1
+
     try:
         with conn.cursor() as cur:
-            cur.execute("""
+            psycopg2.extras.execute_values(cur, """
                 INSERT INTO pvpedge_sapapi (
                     pvpedge_sapapi_lastid,
                     pvpedge_sapapi_sapLineNo,
@@ -74,29 +115,16 @@ def insert_order_to_db(conn, record, new_id):
                     pvpedge_sapapi_sapConfirm,
                     pvpedge_sapapi_sapPalletNumber,
                     pvpedge_sapapi_handlingUnitLabelCode
-                ) VALUES (%s, %s, %s, %s, %s, %s, %s, %s, %s, %s, %s, %s, %s, %s)
+                ) VALUES %s
                 ON CONFLICT (pvpedge_sapapi_handlingUnitLabelCode) DO NOTHING;
-            """, (
-                new_id,
-                record.get("lineNo"),
-                record.get("index"),
-                record.get("packaging"),
-                None,  # content not provided
-                record.get("batch"),
-                record.get("count"),
-                record.get("order"),
-                record.get("ean"),
-                record.get("prodDate"),
-                None,  # tStamp not provided
-                None,  # confirm not provided
-                record.get("palletNumber"),
-                record.get("handlingUnitLabelCode")
-            ))
+            """, rows, page_size=500)
             conn.commit()
-            logging.info(f"Inserted handlingUnitLabelCode={record.get('handlingUnitLabelCode')}")
+            logging.info(f"Inserted batch of {len(rows)} records.")
+            return len(rows)
     except DatabaseError as e:
         logging.error(f"DB insert error: {e}")
         conn.rollback()
+        return 0
 
 def main():
     conn = connect_db()
@@ -104,15 +132,18 @@ def main():
         return
 
     try:
+        # read lastId once at startup, then track it in memory; only go back
+        # to the database when a batch fails and the counter may be stale
+        last_id = get_last_id(conn)
         while True:
-            last_id = get_last_id(conn)
             logging.info(f"Polling API from lastId={last_id} ...")
             api_data = fetch_new_orders_from_api(last_id)
             if api_data and api_data.get("ok") and api_data.get("list"):
-                new_id = last_id + 1
-                for record in api_data["list"]:
-                    insert_order_to_db(conn, record, new_id)
-                    new_id += 1
+                inserted = insert_orders_to_db(conn, api_data["list"], last_id + 1)
+                if inserted:
+                    last_id += inserted
+                else:
+                    last_id = get_last_id(conn)
             else:
                 logging.info("No new data from API.")
             time.sleep(POLL_INTERVAL)
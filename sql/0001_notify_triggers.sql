@@ -0,0 +1,48 @@
+-- LISTEN/NOTIFY wake-up channels so the Python services can block on
+-- select() instead of busy-polling the tables. One channel per service:
+--   pvpedge_new_order   -> api_service_main   (order confirmed, ready to send)
+--   pvpedge_new_image   -> photo_api_service_main (image blobs saved)
+--   pvpedge_plc_trigger -> plc_service_main   (new SAP record inserted)
+-- Postgres coalesces duplicate NOTIFYs within a transaction, so the
+-- per-row trigger overhead is negligible.
+
+CREATE OR REPLACE FUNCTION pvpedge_notify_new_order() RETURNS trigger AS $$
+BEGIN
+    PERFORM pg_notify('pvpedge_new_order', '');
+    RETURN NEW;
+END;
+$$ LANGUAGE plpgsql;
+
+CREATE OR REPLACE FUNCTION pvpedge_notify_new_image() RETURNS trigger AS $$
+BEGIN
+    PERFORM pg_notify('pvpedge_new_image', '');
+    RETURN NEW;
+END;
+$$ LANGUAGE plpgsql;
+
+CREATE OR REPLACE FUNCTION pvpedge_notify_plc_trigger() RETURNS trigger AS $$
+BEGIN
+    PERFORM pg_notify('pvpedge_plc_trigger', '');
+    RETURN NEW;
+END;
+$$ LANGUAGE plpgsql;
+
+DROP TRIGGER IF EXISTS trg_pvpedge_new_order ON pvpedge_orders;
+CREATE TRIGGER trg_pvpedge_new_order
+    AFTER INSERT OR UPDATE OF pvpedge_orders_confirm, api_data_sent ON pvpedge_orders
+    FOR EACH ROW
+    WHEN (NEW.api_data_sent = FALSE AND NEW.pvpedge_orders_confirm IS NOT NULL)
+    EXECUTE FUNCTION pvpedge_notify_new_order();
+
+DROP TRIGGER IF EXISTS trg_pvpedge_new_image ON pvpedge_orders;
+CREATE TRIGGER trg_pvpedge_new_image
+    AFTER INSERT OR UPDATE OF pvpedge_orders_images_blob_saved ON pvpedge_orders
+    FOR EACH ROW
+    WHEN (NEW.pvpedge_orders_images_blob_saved = TRUE AND NEW.pvpedge_orders_images_sent = FALSE)
+    EXECUTE FUNCTION pvpedge_notify_new_image();
+
+DROP TRIGGER IF EXISTS trg_pvpedge_plc_trigger ON pvpedge_sapapi;
+CREATE TRIGGER trg_pvpedge_plc_trigger
+    AFTER INSERT ON pvpedge_sapapi
+    FOR EACH ROW
+    EXECUTE FUNCTION pvpedge_notify_plc_trigger();
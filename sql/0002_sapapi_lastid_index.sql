@@ -0,0 +1,5 @@
+-- Backs the single-row lastid lookup in sapapi_service_ so it is an
+-- index-only descent instead of a seq-scan MAX() that grows with the table.
+
+CREATE INDEX IF NOT EXISTS idx_sapapi_lastid
+    ON pvpedge_sapapi (pvpedge_sapapi_lastid DESC);
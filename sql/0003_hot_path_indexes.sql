@@ -0,0 +1,15 @@
+-- Partial indexes matching the hot-path predicates of the polling queries,
+-- so the LIMIT 1 fetches are index descents instead of growing seq-scans.
+
+CREATE INDEX IF NOT EXISTS idx_orders_api_unsent
+    ON pvpedge_orders (pvpedge_orders_timestamp)
+    WHERE api_data_sent = FALSE AND pvpedge_orders_confirm IS NOT NULL;
+
+CREATE INDEX IF NOT EXISTS idx_orders_plc_unacked
+    ON pvpedge_orders (pvpedge_orders_id DESC)
+    WHERE plc_ack_sent = FALSE;
+
+CREATE INDEX IF NOT EXISTS idx_orders_images_unsent
+    ON pvpedge_orders (pvpedge_orders_id)
+    WHERE pvpedge_orders_images_blob_saved = TRUE
+      AND pvpedge_orders_images_sent = FALSE;
@@ -0,0 +1,18 @@
+-- Per-photo sent tracking so a partial failure only re-sends the missing
+-- photos instead of re-reading and re-uploading all five blobs.
+-- Bits: READER=1, CAM_1=2, CAM_2=4, WRAPPED_CAM_1=8, WRAPPED_CAM_2=16.
+
+ALTER TABLE pvpedge_orders
+    ADD COLUMN IF NOT EXISTS image_sent_mask SMALLINT NOT NULL DEFAULT 0;
+
+-- orders already fully sent get the complete mask
+UPDATE pvpedge_orders
+SET image_sent_mask = 31
+WHERE pvpedge_orders_images_sent = TRUE;
+
+-- retarget the hot-path index at the new predicate
+DROP INDEX IF EXISTS idx_orders_images_unsent;
+CREATE INDEX idx_orders_images_unsent
+    ON pvpedge_orders (pvpedge_orders_id)
+    WHERE pvpedge_orders_images_blob_saved = TRUE
+      AND image_sent_mask <> 31;